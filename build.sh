@@ -4,9 +4,14 @@
 apt-get update
 
 # Install Tesseract OCR (and dependencies)
-apt-get install -y tesseract-ocr
+apt-get install -y tesseract-ocr libtesseract-dev libleptonica-dev pkg-config
 
 # Install other dependencies from requirements.txt
 pip install --no-cache-dir -r requirements.txt
+
+# Compile lab_processor.py with mypyc
+pip install --no-cache-dir mypy setuptools
+python setup.py build_ext --inplace
+
 # Verify the Tesseract installation
 tesseract --version
@@ -1,12 +1,37 @@
 import pytesseract
+import cv2
 from PIL import Image
 import io
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, cast
 import numpy as np
 import os
 import logging
 import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Prefer RE2 (linear-time matching, no catastrophic backtracking) when installed
+try:
+    import re2 as regex_engine
+except ImportError:
+    regex_engine = re
+
+# Whitespace other than newline, as an explicit character set so it can sit in one
+# class with other characters. This is exactly what each engine's \s matches minus
+# '\n': RE2's \s is ASCII [\t\n\f\r ], stdlib re's \s is str.isspace().
+if regex_engine is re:
+    INLINE_SPACE = (r'\t\x0b\x0c\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a'
+                    r'\u2028\u2029\u202f\u205f\u3000')
+else:
+    INLINE_SPACE = r'\t\f\r '
+
+# Prefer the in-process Tesseract C API (no subprocess per image) when installed
+try:
+    from tesserocr import PyTessBaseAPI, PSM, OEM
+except ImportError:
+    PyTessBaseAPI = None
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,13 +42,95 @@ file_handler.setFormatter(formatter)
 logger = logging.getLogger(__name__)
 logger.addHandler(file_handler)
 
+# Number of images handed to a single Tesseract invocation in list-file mode
+# (Tesseract is known to hang on much longer lists)
+NATIVE_BATCH_SIZE = 32
+
+# Single pattern matching test name, value and reference range, with the unit
+# either between value and range or after the range. Whitespace excludes newlines
+# so a match never spans lines when scanning the whole OCR text.
+TEST_LINE_PATTERN = regex_engine.compile(
+    r'(?P<name>[A-Za-z\(\)' + INLINE_SPACE + r']+?)[^\S\n]*(?P<value>[\d\.]+)[^\S\n]*'
+    r'(?:(?P<unit_before>[A-Za-z\/%]+)[^\S\n]*)?'
+    r'(?P<ref_min>[\d\.\-]+)[^\S\n]*-[^\S\n]*(?P<ref_max>[\d\.\-]+)'
+    r'(?:[^\S\n]*(?P<unit_after>[A-Za-z\/%]+))?'
+)
+
+# Trailing unit on any continuation line
+UNIT_PATTERN = regex_engine.compile(r'(?m)([A-Za-z\/%]+)$')
+
+# Images whose shorter side is below this many pixels are upscaled before OCR, by
+# at most UPSCALE_FACTOR and only until the shorter side reaches UPSCALE_MIN_SIZE
+# or the image reaches UPSCALE_MAX_PIXELS; smaller factors than UPSCALE_MIN_FACTOR
+# are skipped since the resample would cost time and blur for no legibility gain
+UPSCALE_MIN_SIZE = 1000
+UPSCALE_FACTOR = 3
+UPSCALE_MAX_PIXELS = 4_000_000
+UPSCALE_MIN_FACTOR = 1.5
+
+# Write buffer size for CSV exports
+CSV_WRITE_BUFFER_SIZE = 1 << 20
+
+# Kernel used to sharpen character edges before thresholding
+SHARPEN_KERNEL = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32)
+
+# Resolve the Tesseract executable once at import; worker processes inherit it
+# by re-importing this module
+_TESSERACT_CMD = shutil.which("tesseract")
+if _TESSERACT_CMD:
+    pytesseract.pytesseract.tesseract_cmd = _TESSERACT_CMD
+
+def _create_tess_api() -> Any:
+    """
+    Create a tesserocr API handle configured like the pytesseract path.
+    
+    Returns:
+        PyTessBaseAPI instance
+    """
+    return PyTessBaseAPI(psm=PSM.SINGLE_BLOCK, oem=OEM.DEFAULT)
+
+# Processor owned by a batch worker process
+_worker_processor: Optional["LabReportProcessor"] = None
+
+def _init_batch_worker(denoise: bool) -> None:
+    """
+    Initialize a batch worker process so Tesseract startup is paid once per worker.
+    
+    Args:
+        denoise: Whether the worker's processor denoises images before OCR
+    """
+    global _worker_processor
+    _worker_processor = LabReportProcessor(max_workers=1, denoise=denoise)
+
+def _process_report_in_worker(image_bytes: bytes) -> List[Dict[str, Any]]:
+    """
+    Process a lab report image with the batch worker's processor.
+    
+    Args:
+        image_bytes: Raw image bytes
+        
+    Returns:
+        List of dictionaries containing test information
+    """
+    assert _worker_processor is not None, "batch worker not initialized"
+    return _worker_processor.process_report(image_bytes)
+
 class LabReportProcessor:
-    def __init__(self):
+    # No per-instance __dict__; the processor only carries its settings and Tesseract handle
+    __slots__ = ('max_workers', 'denoise', '_api', '_preview_cache')
+    
+    # Tesseract options used for every OCR call
+    _TESS_CONFIG = '--psm 6 --oem 3'
+
+    def __init__(self, max_workers: Optional[int] = None, denoise: bool = False):
+        # Number of worker processes used by process_batch (defaults to CPU count)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        
+        # Non-local means denoising helps noisy scans but costs seconds per page
+        self.denoise = denoise
+        
         # Check if Tesseract is in the PATH
-        tesseract_path = shutil.which("tesseract")
-        if tesseract_path:
-            pytesseract.pytesseract.tesseract_cmd = tesseract_path
-        else:
+        if not _TESSERACT_CMD:
             raise Exception("Tesseract not found in PATH. Please install Tesseract.")
         
         # Verify Tesseract is accessible
@@ -31,6 +138,17 @@ class LabReportProcessor:
             pytesseract.get_tesseract_version()
         except Exception as e:
             raise Exception(f"Tesseract initialization failed: {str(e)}")
+        
+        # Raw bytes and preprocessed image from the last process_image_for_preview call
+        self._preview_cache: Optional[Tuple[bytes, Image.Image]] = None
+        
+        # Persistent Tesseract API handle, reused for every image (not thread-safe)
+        self._api = None
+        if PyTessBaseAPI is not None:
+            try:
+                self._api = _create_tess_api()
+            except Exception as e:
+                raise Exception(f"Tesseract initialization failed: {str(e)}")
 
     def process_report(self, image_bytes: bytes) -> List[Dict[str, Any]]:
         """
@@ -42,25 +160,93 @@ class LabReportProcessor:
         Returns:
             List of dictionaries containing test information
         """
-        try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Preprocess image
-            image = self._preprocess_image(image)
+        return self._process_report(image_bytes, self._api)
+    
+    def process_report_image(self, image: Image.Image, preprocessed: bool = False) -> List[Dict[str, Any]]:
+        """
+        Process an already decoded lab report image and extract test information.
+        
+        Args:
+            image: PIL Image of the lab report
+            preprocessed: True if image is a process_image_for_preview result, which is
+                OCRed as-is; False (default) for a raw decoded image, which is preprocessed
+                first. Passing a preview with False would preprocess (and upscale) it twice.
             
-            # Perform OCR with improved configuration
-            text = pytesseract.image_to_string(image, config='--psm 6 --oem 3')
+        Returns:
+            List of dictionaries containing test information
+        """
+        try:
+            if not preprocessed:
+                image = self._preprocess_image(image)
+            return self._process_preprocessed_image(image, self._api)
+        except Exception as e:
+            logger.error("Error processing image: %s", str(e))
+            raise Exception(f"Error processing image: {str(e)}")
+    
+    def _process_report(self, image_bytes: bytes, api: Any) -> List[Dict[str, Any]]:
+        """
+        Process the lab report image using the given Tesseract API handle.
+        
+        Args:
+            image_bytes: Raw image bytes
+            api: tesserocr API handle, or None to use pytesseract
             
-            # Log extracted text for debugging
-            logger.info("Extracted text:\n%s", text)
+        Returns:
+            List of dictionaries containing test information
+        """
+        try:
+            # Reuse the image decoded and preprocessed for a preview of the same bytes;
+            # the cache is dropped either way so it never outlives the next report
+            preview = self._preview_cache
+            self._preview_cache = None
+            if preview is not None and preview[0] == image_bytes:
+                image = preview[1]
+            else:
+                # Convert bytes to PIL Image and preprocess it
+                image = self._preprocess_image(Image.open(io.BytesIO(image_bytes)))
             
-            # Process the extracted text
-            return self._extract_lab_tests(text)
+            return self._process_preprocessed_image(image, api)
         except Exception as e:
             logger.error("Error processing image: %s", str(e))
             raise Exception(f"Error processing image: {str(e)}")
     
+    def _process_preprocessed_image(self, image: Image.Image, api: Any) -> List[Dict[str, Any]]:
+        """
+        OCR a preprocessed image and extract test information.
+        
+        Args:
+            image: Preprocessed PIL Image
+            api: tesserocr API handle, or None to use pytesseract
+            
+        Returns:
+            List of dictionaries containing test information
+        """
+        # Perform OCR
+        text = self._ocr_image(image, api)
+        
+        # Log extracted text for debugging (can be large, so only at DEBUG)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Extracted text:\n%s", text)
+        
+        # Process the extracted text
+        return self._extract_lab_tests(text)
+    
+    def _ocr_image(self, image: Image.Image, api: Any) -> str:
+        """
+        Run Tesseract on a preprocessed image.
+        
+        Args:
+            image: Preprocessed PIL Image
+            api: tesserocr API handle, or None to use pytesseract
+            
+        Returns:
+            OCR extracted text
+        """
+        if api is not None:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        return pytesseract.image_to_string(image, config=self._TESS_CONFIG)
+    
     def _preprocess_image(self, image: Image.Image) -> Image.Image:
         """
         Preprocess the image to improve OCR accuracy.
@@ -72,12 +258,29 @@ class LabReportProcessor:
             Preprocessed PIL Image
         """
         # Convert to grayscale
-        image = image.convert('L')
+        if image.mode == 'L':
+            gray = np.asarray(image)
+        else:
+            gray = cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2GRAY)
         
-        # Thresholding for better contrast
-        image = image.point(lambda x: 0 if x < 200 else 255, '1')
+        # Upscale small images so characters are large enough for Tesseract
+        height, width = gray.shape
+        scale = min(UPSCALE_FACTOR, UPSCALE_MIN_SIZE / min(width, height),
+                    (UPSCALE_MAX_PIXELS / (width * height)) ** 0.5)
+        if scale >= UPSCALE_MIN_FACTOR:
+            gray = cv2.resize(gray, (round(width * scale), round(height * scale)),
+                              interpolation=cv2.INTER_CUBIC)
         
-        return image
+        # Optionally remove noise, then sharpen character edges
+        if self.denoise:
+            gray = cv2.fastNlMeansDenoising(gray, h=10, templateWindowSize=7, searchWindowSize=21)
+        gray = cv2.filter2D(gray, -1, SHARPEN_KERNEL)
+        
+        # Thresholding for better contrast (pixels >= 200 become white)
+        _, binary = cv2.threshold(gray, 199, 255, cv2.THRESH_BINARY)
+        
+        # Hand Tesseract a true 1-bit image so it skips its own Otsu thresholding
+        return Image.fromarray(binary).convert('1', dither=Image.Dither.NONE)
     
     def _extract_lab_tests(self, text: str) -> List[Dict[str, Any]]:
         """
@@ -89,105 +292,98 @@ class LabReportProcessor:
         Returns:
             List of dictionaries containing test information
         """
-        # Split text into lines
-        lines = text.split('\n')
+        lab_tests: List[Dict[str, Any]] = []
+        current_test: Optional[Dict[str, Any]] = None
         
-        lab_tests = []
-        current_test = None
+        # Log each line for debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            for line in io.StringIO(text):
+                line = line.rstrip('\n')
+                if line and not line.isspace():
+                    logger.debug("Processing line: %s", line)
         
-        for line in lines:
-            # Skip empty lines
-            if not line.strip():
+        # End of the current test's line, where its continuation lines begin
+        continuation_start = 0
+        # End of the last line a match was found on
+        line_end = 0
+        
+        # Scan the whole text in one pass instead of matching line by line
+        for match in TEST_LINE_PATTERN.finditer(text):
+            # Only the first match on a line counts
+            if match.start() < line_end:
                 continue
-                
-            # Log each line for debugging
-            logger.debug("Processing line: %s", line)
-                
+            line_start = text.rfind('\n', 0, match.start()) + 1
+            line_end = text.find('\n', match.end())
+            if line_end == -1:
+                line_end = len(text)
+            
             # Try to extract test name, value, and reference range
-            test_info = self._parse_test_line(line)
+            test_info = self._parse_test_match(match)
+            if not test_info:
+                # Treat the line as a continuation of the current test
+                continue
             
-            if test_info:
-                logger.info("Found test: %s", test_info)
-                if current_test:
-                    lab_tests.append(current_test)
-                current_test = test_info
-            elif current_test:
-                # Try to add more information to current test
-                self._update_test_info(current_test, line)
+            logger.info("Found test: %s", test_info)
+            if current_test:
+                # Try to add more information from the lines between the two tests
+                self._update_test_info(current_test, text, continuation_start, line_start)
+                lab_tests.append(current_test)
+            current_test = test_info
+            continuation_start = line_end
         
         if current_test:
+            self._update_test_info(current_test, text, continuation_start, len(text))
             lab_tests.append(current_test)
             
         return lab_tests
     
-    def _parse_test_line(self, line: str) -> Dict[str, Any]:
+    def _parse_test_match(self, match: Any) -> Optional[Dict[str, Any]]:
         """
-        Parse a line to extract test information.
+        Build test information from a TEST_LINE_PATTERN match.
         
         Args:
-            line: Text line to parse
+            match: Match object for a single test line
             
         Returns:
-            Dictionary containing test information or None if no test found
+            Dictionary containing test information or None if the values are malformed
         """
-        # Flexible pattern to match test name, value, reference range, and unit
-        patterns = [
-            # Pattern 1: Test name, value, range, unit
-            r'([A-Za-z\s\(\)]+)\s*([\d\.]+)\s*([\d\.\-]+)\s*-\s*([\d\.\-]+)\s*([A-Za-z\/%]+)?',
-            # Pattern 2: Test name, value, unit, range
-            r'([A-Za-z\s\(\)]+)\s*([\d\.]+)\s*([A-Za-z\/%]+)\s*([\d\.\-]+)\s*-\s*([\d\.\-]+)',
-            # Pattern 3: Test name, value, range
-            r'([A-Za-z\s\(\)]+)\s*([\d\.]+)\s*([\d\.\-]+)\s*-\s*([\d\.\-]+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, line)
-            if match:
-                try:
-                    if len(match.groups()) == 5:
-                        # Pattern 1 or 2
-                        test_name = match.group(1).strip()
-                        value = float(match.group(2))
-                        if pattern == patterns[0]:
-                            ref_min = float(match.group(3))
-                            ref_max = float(match.group(4))
-                            unit = match.group(5).strip()
-                        else:
-                            unit = match.group(3).strip()
-                            ref_min = float(match.group(4))
-                            ref_max = float(match.group(5))
-                    else:
-                        # Pattern 3
-                        test_name = match.group(1).strip()
-                        value = float(match.group(2))
-                        ref_min = float(match.group(3))
-                        ref_max = float(match.group(4))
-                        unit = ""  # No unit in this pattern
-                    
-                    return {
-                        "test_name": test_name,
-                        "test_value": str(value),
-                        "bio_reference_range": f"{ref_min}-{ref_max}",
-                        "test_unit": unit,
-                        "lab_test_out_of_range": not (ref_min <= value <= ref_max)
-                    }
-                except (ValueError, IndexError) as e:
-                    logger.warning("Error parsing line '%s': %s", line, str(e))
-                    continue
+        try:
+            test_name = match.group('name').strip()
+            # Keep the matched text for output and parse numbers only for the range check
+            value_str = match.group('value')
+            ref_min_str = match.group('ref_min')
+            ref_max_str = match.group('ref_max')
+            value = float(value_str)
+            ref_min = float(ref_min_str)
+            ref_max = float(ref_max_str)
+            unit = match.group('unit_before') or match.group('unit_after') or ""
+            
+            return {
+                "test_name": test_name,
+                "test_value": value_str,
+                "bio_reference_range": f"{ref_min_str}-{ref_max_str}",
+                "test_unit": unit,
+                "lab_test_out_of_range": not (ref_min <= value <= ref_max)
+            }
+        except ValueError as e:
+            logger.warning("Error parsing line '%s': %s", match.group(0), str(e))
         
         return None
     
-    def _update_test_info(self, test: Dict[str, Any], line: str) -> None:
+    def _update_test_info(self, test: Dict[str, Any], text: str, start: int, end: int) -> None:
         """
-        Update test information with additional details from the line.
+        Update test information with additional details from its continuation lines.
         
         Args:
             test: Current test dictionary
-            line: Additional line of text
+            text: OCR extracted text
+            start: Offset where the test's continuation lines begin
+            end: Offset where the continuation lines end
         """
         # Try to extract unit if not already present
         if not test.get("test_unit"):
-            unit_match = re.search(r'([A-Za-z\/%]+)$', line)
+            # Search a slice: RE2 re-encodes the whole string on every offset search
+            unit_match = UNIT_PATTERN.search(text[start:end])
             if unit_match:
                 test["test_unit"] = unit_match.group(1).strip()
 
@@ -201,10 +397,78 @@ class LabReportProcessor:
         Returns:
             List of lists containing test information for each image
         """
-        results = []
-        for image_bytes in image_bytes_list:
-            results.append(self.process_report(image_bytes))
-        return results
+        if PyTessBaseAPI is None:
+            # Images are independent, so OCR them in parallel worker processes,
+            # each with its own processor
+            with ProcessPoolExecutor(max_workers=self.max_workers,
+                                     initializer=_init_batch_worker,
+                                     initargs=(self.denoise,)) as executor:
+                return list(executor.map(_process_report_in_worker, image_bytes_list, chunksize=4))
+        
+        # tesserocr releases the GIL during OCR, so threads run in parallel without
+        # process startup; each thread gets its own API handle since they are not thread-safe
+        thread_state = threading.local()
+        apis: List[Any] = []
+        
+        def process_one(image_bytes: bytes) -> List[Dict[str, Any]]:
+            api = getattr(thread_state, 'api', None)
+            if api is None:
+                api = thread_state.api = _create_tess_api()
+                apis.append(api)
+            return self._process_report(image_bytes, api)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as thread_executor:
+                return list(thread_executor.map(process_one, image_bytes_list))
+        finally:
+            for api in apis:
+                api.End()
+
+    def process_batch_native(self, image_bytes_list: List[bytes]) -> List[List[Dict[str, Any]]]:
+        """
+        Process a batch of lab report images using Tesseract's list-of-files mode,
+        so a single Tesseract process handles many images.
+        
+        Args:
+            image_bytes_list: List of raw image bytes
+            
+        Returns:
+            List of lists containing test information for each image
+        """
+        # Preallocate one slot per image; every slot is assigned below
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(image_bytes_list)
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                for start in range(0, len(image_bytes_list), NATIVE_BATCH_SIZE):
+                    chunk = image_bytes_list[start:start + NATIVE_BATCH_SIZE]
+                    
+                    # Write preprocessed images and the list file Tesseract reads them from
+                    image_paths = []
+                    for i, image_bytes in enumerate(chunk, start):
+                        image = self._preprocess_image(Image.open(io.BytesIO(image_bytes)))
+                        image_path = os.path.join(temp_dir, f"img_{i:05d}.png")
+                        image.save(image_path, format='PNG')
+                        image_paths.append(image_path)
+                    list_path = os.path.join(temp_dir, f"list_{start:05d}.txt")
+                    with open(list_path, mode='w') as list_file:
+                        list_file.write('\n'.join(image_paths) + '\n')
+                    
+                    text = pytesseract.image_to_string(list_path, config=self._TESS_CONFIG)
+                    
+                    # Tesseract terminates each page's text with a form feed, so there must be
+                    # exactly one page per listed image (ignoring the empty tail after the last
+                    # separator); anything else means pages would be attributed to the wrong images
+                    pages = text.split('\x0c')
+                    if len(pages) > 1 and not pages[-1].strip():
+                        pages.pop()
+                    if len(pages) != len(chunk):
+                        raise Exception(f"Tesseract output does not split into {len(chunk)} pages")
+                    for i in range(len(chunk)):
+                        results[start + i] = self._extract_lab_tests(pages[i])
+        except Exception as e:
+            logger.error("Error processing batch: %s", str(e))
+            raise Exception(f"Error processing batch: {str(e)}")
+        return cast(List[List[Dict[str, Any]]], results)
 
     def validate_report_data(self, test_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -234,7 +498,8 @@ class LabReportProcessor:
             output_filepath: Path to the output CSV file
         """
         import csv
-        with open(output_filepath, mode='w', newline='') as file:
+        # Large write buffer so rows are flushed in few syscalls
+        with open(output_filepath, mode='w', newline='', encoding='utf-8', buffering=CSV_WRITE_BUFFER_SIZE) as file:
             writer = csv.DictWriter(file, fieldnames=["test_name", "test_value", "bio_reference_range", "test_unit", "lab_test_out_of_range"])
             writer.writeheader()
             writer.writerows(test_data)
@@ -264,4 +529,8 @@ class LabReportProcessor:
         """
         image = Image.open(io.BytesIO(image_bytes))
         image = self._preprocess_image(image)
+        
+        # Keep a private copy so a following process_report of the same bytes skips
+        # decoding, unaffected by whatever the caller does to the returned preview
+        self._preview_cache = (image_bytes, image.copy())
         return image
@@ -0,0 +1,9 @@
+from setuptools import setup
+from mypyc.build import mypycify
+
+# Compile lab_processor.py ahead of time with mypyc; build in place with
+#   python setup.py build_ext --inplace
+setup(
+    name="lab-report-processor",
+    ext_modules=mypycify(["--ignore-missing-imports", "lab_processor.py"]),
+)
@@ -0,0 +1,162 @@
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lab_processor
+from lab_processor import LabReportProcessor
+from PIL import Image
+
+OCR_TEXT = "WBC 7.2 4.0-11.0 K/uL\n"
+
+
+def make_processor():
+    # Stub out __init__'s Tesseract checks and use the pytesseract OCR path
+    with mock.patch.object(lab_processor, '_TESSERACT_CMD', 'tesseract'), \
+            mock.patch.object(lab_processor, 'PyTessBaseAPI', None), \
+            mock.patch.object(lab_processor.pytesseract, 'get_tesseract_version'):
+        return LabReportProcessor()
+
+
+def png_bytes(size):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class ExtractLabTestsTest(unittest.TestCase):
+    def setUp(self):
+        self.processor = make_processor()
+
+    def test_unit_before_range(self):
+        tests = self.processor._extract_lab_tests("Hemoglobin 13.5 g/dL 12.0-15.0\n")
+        self.assertEqual(tests, [{
+            "test_name": "Hemoglobin",
+            "test_value": "13.5",
+            "bio_reference_range": "12.0-15.0",
+            "test_unit": "g/dL",
+            "lab_test_out_of_range": False,
+        }])
+
+    def test_unit_after_range(self):
+        tests = self.processor._extract_lab_tests("Glucose 110 70 - 100 mg/dL\n")
+        self.assertEqual(tests, [{
+            "test_name": "Glucose",
+            "test_value": "110",
+            "bio_reference_range": "70-100",
+            "test_unit": "mg/dL",
+            "lab_test_out_of_range": True,
+        }])
+
+    def test_unit_on_next_line(self):
+        text = "Report header\nGlucose 110 70 - 100\n\n   \nmg/dL\nWBC 7.2 4.0-11.0 K/uL\n"
+        tests = self.processor._extract_lab_tests(text)
+        self.assertEqual([(t["test_name"], t["test_unit"]) for t in tests],
+                         [("Glucose", "mg/dL"), ("WBC", "K/uL")])
+
+    def test_no_unit(self):
+        tests = self.processor._extract_lab_tests("WBC 7.2 4.0-11.0\n")
+        self.assertEqual(len(tests), 1)
+        self.assertEqual(tests[0]["test_unit"], "")
+        self.assertEqual(tests[0]["bio_reference_range"], "4.0-11.0")
+
+    def test_only_first_match_per_line(self):
+        tests = self.processor._extract_lab_tests("A 1 0-2 B 3 1-5\nC 4 1-9\n")
+        self.assertEqual([t["test_name"] for t in tests], ["A", "C"])
+
+    def test_no_tests(self):
+        self.assertEqual(self.processor._extract_lab_tests("no tests\nat all\n"), [])
+
+
+
+class PreviewAndImageOcrTest(unittest.TestCase):
+    def setUp(self):
+        self.processor = make_processor()
+        patcher = mock.patch.object(lab_processor.pytesseract, 'image_to_string', return_value=OCR_TEXT)
+        self.image_to_string = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ocr_input_size(self):
+        return self.image_to_string.call_args[0][0].size
+
+    def test_preview_cache_hit_reuses_private_copy(self):
+        image_bytes = png_bytes((200, 100))
+        preview = self.processor.process_image_for_preview(image_bytes)
+        preview.thumbnail((32, 32))
+        with mock.patch.object(lab_processor.Image, 'open', wraps=lab_processor.Image.open) as image_open:
+            tests = self.processor.process_report(image_bytes)
+        image_open.assert_not_called()
+        self.assertEqual(self.ocr_input_size(), (600, 300))
+        self.assertEqual([t["test_name"] for t in tests], ["WBC"])
+
+    def test_preview_cache_cleared_on_miss(self):
+        self.processor.process_image_for_preview(png_bytes((200, 100)))
+        self.processor.process_report(png_bytes((300, 100)))
+        self.assertEqual(self.ocr_input_size(), (900, 300))
+        self.assertIsNone(self.processor._preview_cache)
+
+    def test_upscale_skips_marginal_factors(self):
+        self.assertEqual(self.processor.process_image_for_preview(png_bytes((999, 1200))).size, (999, 1200))
+        self.assertEqual(self.processor.process_image_for_preview(png_bytes((500, 600))).size, (1000, 1200))
+
+    def test_process_report_image_raw(self):
+        tests = self.processor.process_report_image(Image.new('RGB', (200, 100), 'white'))
+        self.assertEqual(self.ocr_input_size(), (600, 300))
+        self.assertEqual([t["test_name"] for t in tests], ["WBC"])
+
+    def test_process_report_image_preprocessed(self):
+        preview = self.processor.process_image_for_preview(png_bytes((200, 100)))
+        self.processor.process_report_image(preview, preprocessed=True)
+        self.assertIs(self.image_to_string.call_args[0][0], preview)
+
+
+
+class ProcessBatchNativeTest(unittest.TestCase):
+    def setUp(self):
+        self.processor = make_processor()
+        self.images = [png_bytes((200, 100)) for _ in range(5)]
+
+    def ocr_pages(self, list_path):
+        # One page per listed image, naming the test after the image's index
+        with open(list_path) as list_file:
+            names = [os.path.basename(line.strip()) for line in list_file if line.strip()]
+        return [f"Test{chr(ord('A') + int(name[4:9]))} 1 0-2\n" for name in names]
+
+    def run_batch(self, make_output):
+        def image_to_string(list_path, config):
+            return make_output(self.ocr_pages(list_path))
+        with mock.patch.object(lab_processor.pytesseract, 'image_to_string', side_effect=image_to_string) as ocr:
+            results = self.processor.process_batch_native(self.images)
+        return results, ocr
+
+    def result_names(self, results):
+        return [[t["test_name"] for t in tests] for tests in results]
+
+    def test_pages_with_trailing_separator(self):
+        results, _ = self.run_batch(lambda pages: ''.join(page + '\x0c' for page in pages))
+        self.assertEqual(self.result_names(results), [["TestA"], ["TestB"], ["TestC"], ["TestD"], ["TestE"]])
+
+    def test_pages_without_trailing_separator(self):
+        results, _ = self.run_batch(lambda pages: '\x0c'.join(pages))
+        self.assertEqual(self.result_names(results), [["TestA"], ["TestB"], ["TestC"], ["TestD"], ["TestE"]])
+
+    def test_chunks_across_batch_size(self):
+        with mock.patch.object(lab_processor, 'NATIVE_BATCH_SIZE', 2):
+            results, ocr = self.run_batch(lambda pages: ''.join(page + '\x0c' for page in pages))
+        self.assertEqual(ocr.call_count, 3)
+        self.assertEqual(self.result_names(results), [["TestA"], ["TestB"], ["TestC"], ["TestD"], ["TestE"]])
+
+    def test_missing_page_raises(self):
+        with self.assertRaisesRegex(Exception, "Error processing batch"):
+            self.run_batch(lambda pages: ''.join(page + '\x0c' for page in pages[1:]))
+
+    def test_extra_page_raises(self):
+        with self.assertRaisesRegex(Exception, "Error processing batch"):
+            self.run_batch(lambda pages: ''.join(page + '\x0c' for page in pages + ["TestZ 1 0-2\n"]))
+
+
+if __name__ == '__main__':
+    unittest.main()